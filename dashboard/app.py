@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
 import plotly.express as px
 import plotly.graph_objects as go
@@ -10,7 +11,8 @@ import os
 # Add scripts directory to path for imports
 scripts_path = os.path.join(os.path.dirname(__file__), '..', 'scripts')
 sys.path.insert(0, scripts_path)
-from analytics import CryptoAnalytics
+from analytics import CryptoAnalytics, get_cutoff_timestamp, to_local_datetime
+from schema import ensure_schema
 
 # Page configuration
 st.set_page_config(
@@ -22,6 +24,12 @@ st.set_page_config(
 # Custom CSS for better styling
 st.markdown("""
 <style>
+    .metric-grid {
+        display: grid;
+        grid-template-columns: repeat(4, 1fr);
+        gap: 1rem;
+        margin-bottom: 1rem;
+    }
     .metric-card {
         background-color: #f0f2f6;
         padding: 1rem;
@@ -42,8 +50,25 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_conn():
+    """Get the shared database connection reused across reruns"""
+    conn = sqlite3.connect("data/crypto.db", check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    
+    # The queries below expect epoch timestamps, so migrate a database the scheduler has not touched yet
+    ensure_schema(conn)
+    return conn
+
+@st.cache_resource
+def get_analytics():
+    """Get the analytics engine, created once instead of on every rerun"""
+    return CryptoAnalytics(conn=get_conn())
+
 # Initialize analytics
-analytics = CryptoAnalytics()
+analytics = get_analytics()
 
 # Title and sidebar
 st.title("🚀 Multi-Crypto Analytics Dashboard")
@@ -53,16 +78,20 @@ st.markdown("---")
 st.sidebar.header("📈 Dashboard Controls")
 
 # Connect to database
-@st.cache_data
+@st.cache_data(ttl=600)
+def _symbols_for_watermark(watermark):
+    """Get the distinct symbols, cached per bucket of the max price row id"""
+    cursor = get_conn().cursor()
+    cursor.execute("SELECT DISTINCT symbol FROM prices ORDER BY symbol")
+    symbols = [row[0] for row in cursor.fetchall()]
+    return symbols
+
 def get_crypto_symbols():
     """Get list of available cryptocurrency symbols"""
     try:
-        conn = sqlite3.connect("data/crypto.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT symbol FROM prices ORDER BY symbol")
-        symbols = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return symbols
+        # Re-scan the symbols only when enough new rows arrived to move the watermark bucket
+        watermark = get_conn().execute("SELECT MAX(id) FROM prices").fetchone()[0] or 0
+        return _symbols_for_watermark(watermark // 1000)
     except:
         return []
 
@@ -103,54 +132,97 @@ days = time_periods[selected_period]
 
 # Main dashboard content
 @st.cache_data
-def get_latest_prices():
-    """Get latest prices for selected cryptocurrencies"""
-    conn = sqlite3.connect("data/crypto.db")
-    
-    placeholders = ','.join(['?' for _ in selected_symbols])
+def get_latest_prices(symbols):
+    """Get latest prices and 24h changes for selected cryptocurrencies"""
+    values = ','.join(['(?)' for _ in symbols])
     query = f"""
-    SELECT symbol, price_usd, timestamp, market_cap, volume_24h, price_change_24h
-    FROM prices 
-    WHERE symbol IN ({placeholders})
-    AND id IN (
-        SELECT MAX(id) 
-        FROM prices 
-        WHERE symbol IN ({placeholders})
-        GROUP BY symbol
+    WITH selected(symbol) AS (VALUES {values})
+    SELECT p.symbol, p.price_usd, p.timestamp, p.market_cap, p.volume_24h,
+           COALESCE((p.price_usd - pr.price_usd) / pr.price_usd * 100, p.price_change_24h) AS price_change_24h
+    FROM selected s
+    -- Correlated lookups are one index seek per symbol; a GROUP BY join over prices made the
+    -- planner build an automatic index on every call once ANALYZE statistics exist
+    JOIN prices p ON p.id = (
+        SELECT id FROM prices WHERE symbol = s.symbol ORDER BY id DESC LIMIT 1
+    )
+    LEFT JOIN prices pr ON pr.id = (
+        SELECT id FROM prices WHERE symbol = s.symbol AND timestamp BETWEEN ? AND ?
+        ORDER BY timestamp DESC LIMIT 1
     )
-    ORDER BY market_cap DESC
+    ORDER BY p.market_cap DESC
     """
     
-    params = selected_symbols + selected_symbols
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+    # Only a row from the hour before the 24h mark counts as the prior price; after a gap in
+    # collection the change falls back to the API's own price_change_24h
+    cutoff = get_cutoff_timestamp(1)
+    params = list(symbols) + [cutoff - 3600, cutoff]
+    df = pd.read_sql_query(query, get_conn(), params=params)
     
     return df
 
 @st.cache_data
 def get_historical_data(symbols, days):
     """Get historical data for selected cryptocurrencies"""
-    conn = sqlite3.connect("data/crypto.db")
-    
     placeholders = ','.join(['?' for _ in symbols])
     query = f"""
     SELECT symbol, price_usd, timestamp, market_cap, volume_24h, price_change_24h
     FROM prices 
     WHERE symbol IN ({placeholders})
-    AND datetime(timestamp) >= datetime('now', '-{days} days')
+    AND timestamp >= ?
     ORDER BY timestamp ASC
     """
     
-    df = pd.read_sql_query(query, conn, params=symbols)
-    conn.close()
+    df = pd.read_sql_query(query, get_conn(), params=list(symbols) + [get_cutoff_timestamp(days)])
     
     if not df.empty:
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df['timestamp'] = to_local_datetime(df['timestamp'])
     
     return df
 
+def downsample_series(df, value_col, n_out=2000):
+    """Reduce each symbol's series to about n_out points, keeping bucket minima and maxima"""
+    frames = []
+    for _, group in df.groupby('symbol', sort=False):
+        group = group.dropna(subset=[value_col])
+        if len(group) <= n_out:
+            frames.append(group)
+            continue
+        
+        # Split the series into n_out / 2 buckets and keep each bucket's extremes
+        values = pd.Series(group[value_col].to_numpy())
+        buckets = np.arange(len(values)) * (n_out // 2) // len(values)
+        keep = np.unique(np.concatenate([
+            values.groupby(buckets).idxmin().to_numpy(),
+            values.groupby(buckets).idxmax().to_numpy(),
+            [0, len(values) - 1]
+        ]))
+        frames.append(group.iloc[keep])
+    
+    return pd.concat(frames) if frames else df
+
+def get_latest_id():
+    """Get the latest price row id, used to invalidate cached analytics"""
+    # MAX over the rowid is a single seek to the end of the table
+    return get_conn().execute("SELECT MAX(id) FROM prices").fetchone()[0] or 0
+
+@st.cache_data(ttl=300, show_spinner=False)
+def all_analytics(symbols, watermark):
+    """Get analytics for all selected symbols, recomputed only when new price rows arrive"""
+    # Same vectorized pass the scheduler stores, so displayed and stored metrics agree
+    return analytics.generate_all_analytics(list(symbols))
+
+def aggregate_volume(df, days):
+    """Average each symbol's 24h volume into hourly buckets, or daily ones for long periods"""
+    freq = 'h' if days <= 7 else 'D'
+    return (
+        df.dropna(subset=['volume_24h'])
+        .groupby(['symbol', pd.Grouper(key='timestamp', freq=freq)])['volume_24h']
+        .mean()
+        .reset_index()
+    )
+
 # Get latest prices
-latest_prices = get_latest_prices()
+latest_prices = get_latest_prices(selected_symbols)
 
 if latest_prices.empty:
     st.warning("No recent data available for selected cryptocurrencies.")
@@ -159,28 +231,25 @@ if latest_prices.empty:
 # Display current prices in columns
 st.subheader("💰 Current Prices & Market Data")
 
-cols = st.columns(min(len(selected_symbols), 4))
+def format_metric_card(row):
+    """Render one cryptocurrency's price card as HTML"""
+    change_html = ""
+    if not pd.isna(row.price_change_24h):
+        change_class = "positive-change" if row.price_change_24h >= 0 else "negative-change"
+        change_html = f"<span class='{change_class}'>{row.price_change_24h:+.2f}%</span>"
+    
+    market_cap = f"${row.market_cap:,.0f}" if not pd.isna(row.market_cap) else "N/A"
+    volume_24h = f"${row.volume_24h:,.0f}" if not pd.isna(row.volume_24h) else "N/A"
+    
+    return (
+        f"<div class='metric-card'><h4>{row.symbol}</h4>"
+        f"<p>${row.price_usd:,.2f} {change_html}</p>"
+        f"<small><b>Market Cap:</b> {market_cap}<br><b>Volume 24h:</b> {volume_24h}</small></div>"
+    )
 
-for i, (_, row) in enumerate(latest_prices.iterrows()):
-    col_idx = i % 4
-    with cols[col_idx]:
-        # Price change styling
-        change_24h = row.get('price_change_24h', 0)
-        change_class = "positive-change" if change_24h >= 0 else "negative-change"
-        
-        st.metric(
-            label=f"{row['symbol']}",
-            value=f"${row['price_usd']:,.2f}",
-            delta=f"{change_24h:+.2f}%" if not pd.isna(change_24h) else None
-        )
-        
-        # Additional metrics in expander
-        with st.expander(f"{row['symbol']} Details"):
-            col1, col2 = st.columns(2)
-            with col1:
-                st.write(f"**Market Cap:** ${row.get('market_cap', 0):,.0f}")
-            with col2:
-                st.write(f"**Volume 24h:** ${row.get('volume_24h', 0):,.0f}")
+# Render the whole grid with a single markdown call instead of widgets per coin
+cards = "".join(format_metric_card(row) for row in latest_prices.itertuples(index=False))
+st.markdown(f"<div class='metric-grid'>{cards}</div>", unsafe_allow_html=True)
 
 st.markdown("---")
 
@@ -193,10 +262,11 @@ historical_data = get_historical_data(selected_symbols, days)
 if not historical_data.empty:
     # Price comparison chart
     fig_price = px.line(
-        historical_data, 
+        downsample_series(historical_data, 'price_usd'), 
         x='timestamp', 
         y='price_usd', 
         color='symbol',
+        render_mode='webgl',
         title=f"Cryptocurrency Prices - {selected_period}",
         labels={'price_usd': 'Price (USD)', 'timestamp': 'Time'}
     )
@@ -214,7 +284,7 @@ if not historical_data.empty:
         st.subheader("📊 Trading Volume")
         
         fig_volume = px.bar(
-            historical_data, 
+            aggregate_volume(historical_data, days), 
             x='timestamp', 
             y='volume_24h', 
             color='symbol',
@@ -234,10 +304,19 @@ st.markdown("---")
 st.subheader("📊 Technical Analytics")
 
 # Get analytics for selected cryptocurrencies
+latest_id = get_latest_id()
+
+try:
+    # Compute everything up front so the loop below only renders
+    selected_analytics = all_analytics(tuple(selected_symbols), latest_id)
+except Exception as e:
+    st.error(f"Error loading analytics: {e}")
+    selected_analytics = {}
+
 for symbol in selected_symbols:
     with st.expander(f"Analytics for {symbol}"):
         try:
-            symbol_analytics = analytics.generate_comprehensive_analytics(symbol)
+            symbol_analytics = selected_analytics.get(symbol)
             
             if symbol_analytics:
                 # Create columns for different analytics
@@ -307,8 +386,8 @@ if not latest_prices.empty:
             
             st.write("**Top Performers (24h)**")
             top_performers = latest_prices.nlargest(3, 'price_change_24h')[['symbol', 'price_change_24h']]
-            for _, row in top_performers.iterrows():
-                st.write(f"{row['symbol']}: {row['price_change_24h']:+.2f}%")
+            for row in top_performers.itertuples(index=False):
+                st.write(f"{row.symbol}: {row.price_change_24h:+.2f}%")
 
 # Footer
 st.markdown("---")
@@ -1,253 +1,448 @@
 import sqlite3
+import threading
+import time
 import pandas as pd
 import numpy as np
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Tuple
+from schema import ensure_schema
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional; without it the kernels below run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Format analytics timestamps are written in; price timestamps are stored as Unix seconds
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Kept as a single literal so sqlite3's statement cache reuses the prepared statement;
+# updates the existing row in place on a UNIQUE hit instead of deleting and re-inserting it
+UPSERT_ANALYTICS_SQL = """
+    INSERT INTO analytics 
+    (symbol, metric_name, metric_value, time_period, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(symbol, metric_name, time_period, timestamp)
+    DO UPDATE SET metric_value = excluded.metric_value
+"""
+
+def get_cutoff_timestamp(days: int) -> int:
+    """Get the Unix timestamp `days` ago, comparable with the stored price timestamps"""
+    return int(time.time()) - days * 86400
+
+def to_local_datetime(timestamps: pd.Series) -> pd.Series:
+    """Convert stored Unix timestamps to naive local datetimes for display"""
+    # Look the UTC offset up through localtime, as datetime.fromtimestamp does, so DST is applied
+    # per timestamp; offsets only change on quarter-hour boundaries, so one lookup per quarter hour
+    seconds = timestamps.to_numpy(dtype=np.int64)
+    quarters, inverse = np.unique(seconds // 900, return_inverse=True)
+    offsets = np.array([time.localtime(int(q) * 900).tm_gmtoff for q in quarters], dtype=np.int64)
+    return pd.Series(pd.to_datetime(seconds + offsets[inverse], unit='s'), index=timestamps.index,
+                     name=timestamps.name)
+
+def _format_timestamp(timestamp) -> str:
+    """Format a stored Unix timestamp as local time to the minute"""
+    return datetime.fromtimestamp(int(timestamp)).strftime('%Y-%m-%d %H:%M')
+
+@njit(cache=True)
+def _rsi_last(deltas, period=14):
+    """Compute the final Wilder RSI value from price deltas with two running averages"""
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(period):
+        if deltas[i] > 0:
+            avg_gain += deltas[i]
+        else:
+            avg_loss -= deltas[i]
+    avg_gain /= period
+    avg_loss /= period
+    
+    for i in range(period, len(deltas)):
+        gain = deltas[i] if deltas[i] > 0 else 0.0
+        loss = -deltas[i] if deltas[i] < 0 else 0.0
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+    
+    if avg_loss == 0.0:
+        return 100.0 if avg_gain > 0.0 else np.nan
+    return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+def _volatility_pct(returns: np.ndarray) -> float:
+    """Scale the standard deviation of returns to a percentage volatility"""
+    if len(returns) < 2:
+        return 0.0
+    
+    volatility = returns.std(ddof=1) * np.sqrt(24)  # Annualized volatility
+    return round(float(volatility) * 100, 2)  # Return as percentage
+
 class CryptoAnalytics:
-    def __init__(self, db_path="data/crypto.db"):
+    def __init__(self, db_path="data/crypto.db", conn: sqlite3.Connection = None):
         self.db_path = db_path
+        self.conn = conn if conn is not None else self._connect()
+        self._update_lock = threading.Lock()
+        
+        self._prepare_database()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a database connection with the pragmas used for analytics reads"""
+        # Scheduled jobs call into the analytics from worker threads
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _prepare_database(self):
+        """Enable WAL mode and bring the schema up to date, including the epoch timestamp migration"""
+        try:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            ensure_schema(self.conn)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Could not prepare database: {e}")
     
     def get_price_data(self, symbol: str, days: int = 30) -> pd.DataFrame:
         """Get historical price data for a specific cryptocurrency"""
-        conn = sqlite3.connect(self.db_path)
-        
         query = """
         SELECT symbol, price_usd, timestamp, market_cap, volume_24h, price_change_24h
         FROM prices 
         WHERE symbol = ? 
-        AND datetime(timestamp) >= datetime('now', '-{} days')
+        AND timestamp >= ?
         ORDER BY timestamp ASC
-        """.format(days)
+        """
         
-        df = pd.read_sql_query(query, conn, params=(symbol,))
-        conn.close()
+        df = pd.read_sql_query(query, self.conn, params=(symbol, get_cutoff_timestamp(days)))
         
         if not df.empty:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            df['timestamp'] = to_local_datetime(df['timestamp'])
             df = df.set_index('timestamp')
         
         return df
     
-    def calculate_moving_averages(self, df: pd.DataFrame, windows: List[int] = [7, 30]) -> Dict[str, float]:
+    def get_price_array(self, symbol: str, days: int = 30) -> Tuple[np.ndarray, np.ndarray]:
+        """Get Unix timestamps and prices for a cryptocurrency as typed numpy arrays"""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT timestamp, price_usd
+            FROM prices
+            WHERE symbol = ?
+            AND timestamp >= ?
+            ORDER BY timestamp ASC
+        """, (symbol, get_cutoff_timestamp(days)))
+        rows = cursor.fetchall()
+        
+        timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        prices = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        
+        return timestamps, prices
+    
+    def get_latest_market_data(self, symbol: str) -> Tuple[float, float]:
+        """Get the latest market cap and 24h volume for a cryptocurrency"""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT market_cap, volume_24h
+            FROM prices
+            WHERE symbol = ?
+            ORDER BY id DESC
+            LIMIT 1
+        """, (symbol,))
+        row = cursor.fetchone()
+        
+        return row if row else (None, None)
+    
+    def calculate_moving_averages(self, prices: np.ndarray, windows: List[int] = [7, 30]) -> Dict[str, float]:
         """Calculate moving averages for different time windows"""
-        if df.empty:
+        if len(prices) == 0:
             return {}
         
+        # Only the latest value of each moving average is needed, so average the trailing window
         ma_results = {}
         for window in windows:
-            if len(df) >= window:
-                ma_value = df['price_usd'].rolling(window=window).mean().iloc[-1]
-                ma_results[f'ma_{window}d'] = round(ma_value, 2)
+            if len(prices) >= window:
+                ma_results[f'ma_{window}d'] = round(float(prices[-window:].mean()), 2)
             else:
                 ma_results[f'ma_{window}d'] = None
         
         return ma_results
     
-    def calculate_percentage_changes(self, df: pd.DataFrame) -> Dict[str, float]:
+    def calculate_percentage_changes(self, timestamps: np.ndarray, prices: np.ndarray) -> Dict[str, float]:
         """Calculate percentage changes over different time periods"""
-        if df.empty:
+        if len(prices) == 0:
             return {}
         
-        current_price = df['price_usd'].iloc[-1]
-        changes = {}
+        current_price = prices[-1]
         
-        # 1 hour change
-        hour_ago = datetime.now() - timedelta(hours=1)
-        hour_data = df[df.index >= hour_ago]
-        if len(hour_data) >= 2:
-            hour_price = hour_data['price_usd'].iloc[0]
-            changes['change_1h'] = round(((current_price - hour_price) / hour_price) * 100, 2)
-        else:
-            changes['change_1h'] = None
-        
-        # 24 hour change
-        day_ago = datetime.now() - timedelta(days=1)
-        day_data = df[df.index >= day_ago]
-        if len(day_data) >= 2:
-            day_price = day_data['price_usd'].iloc[0]
-            changes['change_24h'] = round(((current_price - day_price) / day_price) * 100, 2)
-        else:
-            changes['change_24h'] = None
-        
-        # 7 day change
-        week_ago = datetime.now() - timedelta(days=7)
-        week_data = df[df.index >= week_ago]
-        if len(week_data) >= 2:
-            week_price = week_data['price_usd'].iloc[0]
-            changes['change_7d'] = round(((current_price - week_price) / week_price) * 100, 2)
-        else:
-            changes['change_7d'] = None
-        
-        # 30 day change
-        month_ago = datetime.now() - timedelta(days=30)
-        month_data = df[df.index >= month_ago]
-        if len(month_data) >= 2:
-            month_price = month_data['price_usd'].iloc[0]
-            changes['change_30d'] = round(((current_price - month_price) / month_price) * 100, 2)
-        else:
-            changes['change_30d'] = None
+        # Locate the first row of every window with one binary search per cutoff
+        periods = ['change_1h', 'change_24h', 'change_7d', 'change_30d']
+        offsets = np.array([3600, 86400, 7 * 86400, 30 * 86400], dtype=np.int64)
+        cutoffs = int(time.time()) - offsets
+        starts = np.searchsorted(timestamps, cutoffs, side='left')
         
-        return changes
-    
-    def calculate_volatility(self, df: pd.DataFrame, days: int = 7) -> float:
-        """Calculate price volatility (standard deviation of returns)"""
-        if len(df) < 2:
-            return 0.0
+        base_prices = prices[np.minimum(starts, len(prices) - 1)]
+        values = np.round((current_price - base_prices) / base_prices * 100, 2)
         
-        # Calculate daily returns
-        returns = df['price_usd'].pct_change().dropna()
+        # A window needs at least two rows to produce a change
+        changes = {
+            period: float(value) if start <= len(prices) - 2 else None
+            for period, value, start in zip(periods, values, starts)
+        }
         
-        # Calculate volatility (standard deviation of returns)
-        volatility = returns.std() * np.sqrt(24)  # Annualized volatility
-        return round(volatility * 100, 2)  # Return as percentage
+        return changes
     
-    def get_min_max_values(self, df: pd.DataFrame, days: int = 7) -> Dict[str, float]:
-        """Get minimum and maximum values for a given period"""
-        if df.empty:
+    def get_min_max_values(self, timestamps: np.ndarray, prices: np.ndarray) -> Dict[str, float]:
+        """Get minimum and maximum values for the given slice"""
+        if len(prices) == 0:
             return {}
         
-        period_data = df[df.index >= datetime.now() - timedelta(days=days)]
-        
-        if period_data.empty:
-            return {}
+        min_idx = int(prices.argmin())
+        max_idx = int(prices.argmax())
         
         return {
-            'min_price': round(period_data['price_usd'].min(), 2),
-            'max_price': round(period_data['price_usd'].max(), 2),
-            'min_time': period_data['price_usd'].idxmin().strftime('%Y-%m-%d %H:%M'),
-            'max_time': period_data['price_usd'].idxmax().strftime('%Y-%m-%d %H:%M')
+            'min_price': round(float(prices[min_idx]), 2),
+            'max_price': round(float(prices[max_idx]), 2),
+            'min_time': _format_timestamp(timestamps[min_idx]),
+            'max_time': _format_timestamp(timestamps[max_idx])
         }
     
-    def calculate_rsi(self, df: pd.DataFrame, period: int = 14) -> float:
-        """Calculate Relative Strength Index (RSI)"""
-        if len(df) < period + 1:
-            return None
-        
-        prices = df['price_usd']
-        delta = prices.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        
-        return round(rsi.iloc[-1], 2) if not pd.isna(rsi.iloc[-1]) else None
-    
     def generate_comprehensive_analytics(self, symbol: str) -> Dict:
         """Generate comprehensive analytics for a cryptocurrency"""
         logger.info(f"Generating analytics for {symbol}")
         
         # Get 30 days of data for comprehensive analysis
-        df = self.get_price_data(symbol, days=30)
+        timestamps, prices = self.get_price_array(symbol, days=30)
         
-        if df.empty:
+        if len(prices) == 0:
             logger.warning(f"No data available for {symbol}")
             return {}
         
-        current_price = df['price_usd'].iloc[-1]
+        latest_market_cap, latest_volume_24h = self.get_latest_market_data(symbol)
+        
+        # Slice the 7 and 30 day windows once with binary searches on the sorted timestamps
+        cut_7d = np.searchsorted(timestamps, get_cutoff_timestamp(7))
+        cut_30d = np.searchsorted(timestamps, get_cutoff_timestamp(30))
+        
+        # One pass of price deltas serves both the return-based and RSI metrics;
+        # returns[cut:] are exactly the returns of prices[cut:]
+        deltas = np.diff(prices)
+        returns = deltas / prices[:-1]
+        rsi = _rsi_last(deltas, 14) if len(deltas) >= 14 else np.nan
         
         analytics = {
             'symbol': symbol,
-            'current_price': round(current_price, 2),
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'moving_averages': self.calculate_moving_averages(df),
-            'percentage_changes': self.calculate_percentage_changes(df),
-            'volatility_7d': self.calculate_volatility(df, days=7),
-            'volatility_30d': self.calculate_volatility(df, days=30),
-            'min_max_7d': self.get_min_max_values(df, days=7),
-            'min_max_30d': self.get_min_max_values(df, days=30),
-            'rsi_14': self.calculate_rsi(df),
-            'data_points': len(df),
-            'latest_market_cap': df['market_cap'].iloc[-1] if 'market_cap' in df.columns else None,
-            'latest_volume_24h': df['volume_24h'].iloc[-1] if 'volume_24h' in df.columns else None
+            'current_price': round(float(prices[-1]), 2),
+            'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT),
+            'moving_averages': self.calculate_moving_averages(prices),
+            'percentage_changes': self.calculate_percentage_changes(timestamps, prices),
+            'volatility_7d': _volatility_pct(returns[cut_7d:]),
+            'volatility_30d': _volatility_pct(returns[cut_30d:]),
+            'min_max_7d': self.get_min_max_values(timestamps[cut_7d:], prices[cut_7d:]),
+            'min_max_30d': self.get_min_max_values(timestamps[cut_30d:], prices[cut_30d:]),
+            'rsi_14': round(float(rsi), 2) if not np.isnan(rsi) else None,
+            'data_points': len(prices),
+            'latest_market_cap': latest_market_cap,
+            'latest_volume_24h': latest_volume_24h
         }
         
         return analytics
+
+    def generate_all_analytics(self, symbols: List[str] = None) -> Dict[str, Dict]:
+        """Generate comprehensive analytics for every (or the given) cryptocurrency in one vectorized pass"""
+        params = [get_cutoff_timestamp(30)]
+        symbol_filter = ""
+        if symbols is not None:
+            symbol_filter = f"AND symbol IN ({','.join(['?' for _ in symbols])})"
+            params += list(symbols)
+        
+        query = f"""
+        SELECT symbol, price_usd, timestamp, market_cap, volume_24h
+        FROM prices
+        WHERE timestamp >= ?
+        {symbol_filter}
+        ORDER BY symbol, timestamp ASC
+        """
+
+        df = pd.read_sql_query(query, self.conn, params=params)
+
+        if df.empty:
+            logger.warning("No data available for analytics")
+            return {}
+
+        df = df.set_index(['symbol', 'timestamp'])
+        timestamps = df.index.get_level_values('timestamp')
+        now = int(time.time())
+
+        g = df.groupby(level=0, sort=False)['price_usd']
+        current = g.last()
+        counts = g.size()
+
+        # Moving averages (mean of each symbol's trailing window)
+        ma7 = g.tail(7).groupby(level=0).mean().where(counts >= 7)
+        ma30 = g.tail(30).groupby(level=0).mean().where(counts >= 30)
+
+        # RSI with the same Wilder kernel as the per-symbol path (SMA-seeded)
+        period = 14
+        rsi = g.agg(lambda prices: _rsi_last(np.diff(prices.to_numpy()), period)
+                    if len(prices) >= period + 1 else np.nan)
+
+        # Percentage changes against the first price inside each window
+        changes = {}
+        for name, window in [('change_1h', 3600), ('change_24h', 86400),
+                             ('change_7d', 7 * 86400), ('change_30d', 30 * 86400)]:
+            window_group = df.loc[timestamps >= now - window, 'price_usd'].groupby(level=0)
+            first = window_group.first()
+            changes[name] = ((current - first) / first * 100).where(window_group.size() >= 2)
+
+        # Volatility (standard deviation of returns) and min/max values for each period
+        volatility = {}
+        min_max = {}
+        for days in (7, 30):
+            period_group = df.loc[timestamps >= now - days * 86400, 'price_usd'].groupby(level=0)
+            returns = period_group.pct_change().groupby(level=0).std() * np.sqrt(24) * 100
+            volatility[days] = returns.reindex(current.index).fillna(0.0)
+            min_max[days] = period_group.agg(['min', 'max', 'idxmin', 'idxmax'])
+
+        latest = df.groupby(level=0, sort=False).tail(1).reset_index(level=1)
+        timestamp = datetime.fromtimestamp(now).strftime(TIMESTAMP_FORMAT)
+
+        def _round(value):
+            return None if pd.isna(value) else round(float(value), 2)
+
+        # Missing market data comes back as NaN from pandas but as None from sqlite3
+        def _optional(value):
+            return None if pd.isna(value) else float(value)
+
+        results = {}
+        for symbol in current.index:
+            symbol_min_max = {}
+            for days, stats in min_max.items():
+                if symbol in stats.index:
+                    row = stats.loc[symbol]
+                    symbol_min_max[days] = {
+                        'min_price': _round(row['min']),
+                        'max_price': _round(row['max']),
+                        'min_time': _format_timestamp(row['idxmin'][1]),
+                        'max_time': _format_timestamp(row['idxmax'][1])
+                    }
+                else:
+                    symbol_min_max[days] = {}
+
+            results[symbol] = {
+                'symbol': symbol,
+                'current_price': _round(current[symbol]),
+                'timestamp': timestamp,
+                'moving_averages': {'ma_7d': _round(ma7[symbol]), 'ma_30d': _round(ma30[symbol])},
+                'percentage_changes': {name: _round(values.get(symbol)) for name, values in changes.items()},
+                'volatility_7d': _round(volatility[7][symbol]),
+                'volatility_30d': _round(volatility[30][symbol]),
+                'min_max_7d': symbol_min_max[7],
+                'min_max_30d': symbol_min_max[30],
+                'rsi_14': _round(rsi[symbol]),
+                'data_points': int(counts[symbol]),
+                'latest_market_cap': _optional(latest.at[symbol, 'market_cap']),
+                'latest_volume_24h': _optional(latest.at[symbol, 'volume_24h'])
+            }
+
+        return results
+
+    def _analytics_rows(self, analytics: Dict) -> List[Tuple]:
+        """Flatten computed analytics into rows for the analytics table"""
+        symbol = analytics['symbol']
+        timestamp = analytics['timestamp']
+        
+        # Moving averages and percentage changes
+        rows = [(symbol, metric_name, value, '30d', timestamp)
+                for metric_name, value in analytics['moving_averages'].items() if value is not None]
+        rows += [(symbol, metric_name, value, 'current', timestamp)
+                 for metric_name, value in analytics['percentage_changes'].items() if value is not None]
+        
+        # Volatility and RSI
+        if analytics.get('volatility_7d') is not None:
+            rows.append((symbol, 'volatility', analytics['volatility_7d'], '7d', timestamp))
+        if analytics.get('rsi_14') is not None:
+            rows.append((symbol, 'rsi', analytics['rsi_14'], '14d', timestamp))
+        
+        return rows
+    
+    def _insert_analytics_rows(self, rows: List[Tuple], last_id: int = None):
+        """Insert analytics rows in a single transaction, optionally recording the last processed price id"""
+        with self.conn:
+            self.conn.executemany(UPSERT_ANALYTICS_SQL, rows)
+            if last_id is not None:
+                self.conn.execute("INSERT OR REPLACE INTO sync_state (metric, last_id) VALUES ('analytics', ?)",
+                                  (last_id,))
     
     def store_analytics(self, analytics: Dict):
         """Store computed analytics in the database"""
         if not analytics:
             return
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         symbol = analytics['symbol']
-        timestamp = analytics['timestamp']
         
         try:
-            # Store moving averages
-            for metric_name, value in analytics['moving_averages'].items():
-                if value is not None:
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO analytics 
-                        (symbol, metric_name, metric_value, time_period, timestamp)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (symbol, metric_name, value, '30d', timestamp))
-            
-            # Store percentage changes
-            for metric_name, value in analytics['percentage_changes'].items():
-                if value is not None:
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO analytics 
-                        (symbol, metric_name, metric_value, time_period, timestamp)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (symbol, metric_name, value, 'current', timestamp))
-            
-            # Store volatility metrics
-            if analytics.get('volatility_7d') is not None:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO analytics 
-                    (symbol, metric_name, metric_value, time_period, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (symbol, 'volatility', analytics['volatility_7d'], '7d', timestamp))
-            
-            # Store RSI
-            if analytics.get('rsi_14') is not None:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO analytics 
-                    (symbol, metric_name, metric_value, time_period, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (symbol, 'rsi', analytics['rsi_14'], '14d', timestamp))
-            
-            conn.commit()
+            self._insert_analytics_rows(self._analytics_rows(analytics))
             logger.info(f"Analytics stored for {symbol}")
-            
         except Exception as e:
             logger.error(f"Error storing analytics for {symbol}: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
     
     def get_all_symbols(self) -> List[str]:
         """Get list of all cryptocurrency symbols in the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         cursor.execute("SELECT DISTINCT symbol FROM prices ORDER BY symbol")
         symbols = [row[0] for row in cursor.fetchall()]
         
-        conn.close()
         return symbols
     
     def update_all_analytics(self):
         """Update analytics for all cryptocurrencies in the database"""
-        symbols = self.get_all_symbols()
-        logger.info(f"Updating analytics for {len(symbols)} cryptocurrencies")
-        
-        for symbol in symbols:
+        with self._update_lock:
+            last_id = self.conn.execute("SELECT MAX(id) FROM prices").fetchone()[0] or 0
+            self._update_analytics(None, last_id)
+    
+    def update_incremental(self):
+        """Update analytics only for cryptocurrencies with price rows added since the last update"""
+        with self._update_lock:
+            row = self.conn.execute("SELECT last_id FROM sync_state WHERE metric = 'analytics'").fetchone()
+            last_id = row[0] if row else 0
+            
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT symbol, MAX(id) FROM prices WHERE id > ? GROUP BY symbol", (last_id,))
+            changed = dict(cursor.fetchall())
+            
+            if not changed:
+                logger.info("Analytics already up to date")
+                return
+            
+            # The windowed metrics still need each changed symbol's full 30 days
+            self._update_analytics(list(changed), max(changed.values()))
+    
+    def _update_analytics(self, symbols: List[str], last_id: int):
+        """Recompute and store analytics for the given symbols (or all when None)"""
+        try:
+            all_analytics = self.generate_all_analytics(symbols)
+        except Exception as e:
+            logger.error(f"Error generating analytics: {e}")
+            return
+
+        logger.info(f"Updating analytics for {len(all_analytics)} cryptocurrencies")
+
+        rows = []
+        for symbol, analytics in all_analytics.items():
             try:
-                analytics = self.generate_comprehensive_analytics(symbol)
-                self.store_analytics(analytics)
+                rows.extend(self._analytics_rows(analytics))
             except Exception as e:
                 logger.error(f"Error updating analytics for {symbol}: {e}")
 
+        # Commit every symbol's metrics together with the sync position
+        try:
+            self._insert_analytics_rows(rows, last_id)
+            logger.info(f"Stored {len(rows)} analytics rows")
+        except Exception as e:
+            logger.error(f"Error storing analytics: {e}")
+
 if __name__ == "__main__":
     analytics = CryptoAnalytics()
     analytics.update_all_analytics()
@@ -1,15 +1,21 @@
 import requests
 import sqlite3
 import logging
-from datetime import datetime
-import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from schema import ensure_schema
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('data/fetch_log.log'),
+        RotatingFileHandler('data/fetch_log.log', maxBytes=5_000_000, backupCount=3),
         logging.StreamHandler()
     ]
 )
@@ -26,162 +32,254 @@ CRYPTOCURRENCIES = {
     'bitcoin-cash': 'BCH'
 }
 
-def create_database_schema():
-    """Create database tables with enhanced schema"""
-    conn = sqlite3.connect("data/crypto.db")
+# CoinGecko price endpoint for all supported cryptocurrencies
+_API_URL = (
+    "https://api.coingecko.com/api/v3/simple/price?ids=" + ",".join(CRYPTOCURRENCIES)
+    + "&vs_currencies=usd&include_market_cap=true&include_24hr_vol=true&include_24hr_change=true"
+)
+
+# Price endpoints fetched on every tick; each returns {coin_id: {'usd': ..., ...}} like /simple/price
+_ENDPOINTS = [_API_URL]
+
+# Reusable HTTP session: keeps the TLS connection alive and retries transient API errors
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept-Encoding": "gzip", "User-Agent": "crypto-dash/1.0"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+))
+
+# ETag of the last stored response per endpoint, sent back as If-None-Match
+_LAST_ETAGS = {}
+
+# ETags of fetched responses, moved into _LAST_ETAGS once store_crypto_data commits their prices
+_PENDING_ETAGS = {}
+
+# Fetches the endpoints concurrently; created on first use when there is more than one endpoint
+_FETCH_POOL = None
+_FETCH_POOL_LOCK = threading.Lock()
+
+# Returned by fetch_crypto_data when the API reports the prices have not changed
+NOT_MODIFIED = object()
+
+# Shared writer connection, opened on first use and reused across scheduled ticks
+_CONN = None
+_DB_LOCK = threading.RLock()
+
+# Set once create_database_schema has run in this process
+_SCHEMA_READY = False
+
+def _connect():
+    """Open a database connection tuned for the scheduled writer"""
+    # Transactions are managed explicitly, and the scheduler and analytics threads share it
+    conn = sqlite3.connect("data/crypto.db", isolation_level=None,
+                           check_same_thread=False, cached_statements=64)
     cursor = conn.cursor()
     
-    # Check if old schema exists and migrate if needed
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='prices'")
-    table_exists = cursor.fetchone()
+    # Only takes effect on a new database, so it must come before WAL initializes the file;
+    # an existing WAL database keeps its page size
+    cursor.execute("PRAGMA page_size=8192")
     
-    if table_exists:
-        # Check if we have the old schema (with 'rate' column)
-        cursor.execute("PRAGMA table_info(prices)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'rate' in columns and 'symbol' not in columns:
-            logging.info("Migrating from old schema to new schema")
-            # Backup old data
-            cursor.execute("SELECT * FROM prices")
-            old_data = cursor.fetchall()
-            
-            # Drop old table
-            cursor.execute("DROP TABLE prices")
-            
-            # Create new table with enhanced schema
-            cursor.execute("""
-                CREATE TABLE prices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    symbol TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    price_usd REAL NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    market_cap REAL,
-                    volume_24h REAL,
-                    price_change_24h REAL
-                )
-            """)
-            
-            # Migrate old data (assuming it's Bitcoin data)
-            for row in old_data:
-                cursor.execute("""
-                    INSERT INTO prices (symbol, name, price_usd, timestamp, market_cap, volume_24h, price_change_24h)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, ('BTC', 'bitcoin', row[2], row[3], None, None, None))
-            
-            logging.info(f"Migrated {len(old_data)} records from old schema")
+    # WAL lets analytics reads run while the fetcher writes
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA mmap_size=268435456")  # Read pages through a 256 MB memory map
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA wal_autocheckpoint=1000")
     
-    else:
-        # Create new table with enhanced schema
-        cursor.execute("""
-            CREATE TABLE prices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT NOT NULL,
-                name TEXT NOT NULL,
-                price_usd REAL NOT NULL,
-                timestamp TEXT NOT NULL,
-                market_cap REAL,
-                volume_24h REAL,
-                price_change_24h REAL
-            )
-        """)
-    
-    # Analytics table for computed metrics
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS analytics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            symbol TEXT NOT NULL,
-            metric_name TEXT NOT NULL,
-            metric_value REAL NOT NULL,
-            time_period TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            UNIQUE(symbol, metric_name, time_period, timestamp)
-        )
-    """)
-    
-    # Create indexes for better performance (only if columns exist)
-    try:
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prices_symbol_time ON prices(symbol, timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_analytics_symbol_metric ON analytics(symbol, metric_name)")
-    except sqlite3.OperationalError as e:
-        logging.warning(f"Could not create indexes: {e}")
-    
-    conn.commit()
-    conn.close()
+    return conn
+
+def _get_connection():
+    """Get the shared writer connection, opening it on first use"""
+    global _CONN
+    with _DB_LOCK:
+        if _CONN is None:
+            _CONN = _connect()
+        return _CONN
+
+def optimize_database(conn=None):
+    """Refresh SQLite query planner statistics"""
+    conn = conn or _get_connection()
+    with _DB_LOCK:
+        try:
+            conn.execute("PRAGMA optimize")
+            logging.info("Database optimized")
+        except sqlite3.Error as e:
+            logging.warning(f"Database optimize failed: {e}")
+
+def create_database_schema(conn=None):
+    """Create database tables with enhanced schema"""
+    global _SCHEMA_READY
+    conn = conn or _get_connection()
+    
+    with _DB_LOCK:
+        ensure_schema(conn)
+    
+    _SCHEMA_READY = True
     logging.info("Database schema created/updated successfully")
 
+def _fetch_endpoint(url):
+    """Fetch and parse one price endpoint, returning NOT_MODIFIED on HTTP 304"""
+    etag = _LAST_ETAGS.get(url)
+    headers = {"If-None-Match": etag} if etag else {}
+    response = _SESSION.get(url, headers=headers, timeout=30)
+    
+    # Unchanged since the last fetch: skip parsing
+    if response.status_code == 304:
+        return NOT_MODIFIED
+    
+    response.raise_for_status()
+    
+    data = orjson.loads(response.content)
+    _PENDING_ETAGS[url] = response.headers.get("ETag")
+    return data
+
+def _get_fetch_pool():
+    """Get the endpoint fetch pool, creating it on first use"""
+    global _FETCH_POOL
+    with _FETCH_POOL_LOCK:
+        if _FETCH_POOL is None:
+            _FETCH_POOL = ThreadPoolExecutor(max_workers=len(_ENDPOINTS))
+        return _FETCH_POOL
+
+def shutdown_fetch_pool():
+    """Stop the endpoint fetch pool's threads, if it was started"""
+    global _FETCH_POOL
+    with _FETCH_POOL_LOCK:
+        pool, _FETCH_POOL = _FETCH_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
 def fetch_crypto_data():
     """Fetch data for all supported cryptocurrencies"""
-    try:
-        # Build API URL for multiple cryptocurrencies
-        crypto_ids = ','.join(CRYPTOCURRENCIES.keys())
-        url = f"https://api.coingecko.com/api/v3/simple/price?ids={crypto_ids}&vs_currencies=usd&include_market_cap=true&include_24hr_vol=true&include_24hr_change=true"
-        
-        logging.info(f"Fetching data for {len(CRYPTOCURRENCIES)} cryptocurrencies")
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        return data
+    logging.info(f"Fetching data for {len(CRYPTOCURRENCIES)} cryptocurrencies")
+    
+    # Request every endpoint at once so the tick waits for the slowest one, not the sum;
+    # a single endpoint is fetched on the calling thread
+    pool = _get_fetch_pool() if len(_ENDPOINTS) > 1 else None
+    futures = [pool.submit(_fetch_endpoint, url) if pool else None for url in _ENDPOINTS]
+    
+    data = {}
+    not_modified = 0
+    for url, future in zip(_ENDPOINTS, futures):
+        try:
+            result = future.result() if future else _fetch_endpoint(url)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"API request failed: {e}")
+            continue
+        except Exception as e:
+            logging.error(f"Unexpected error during data fetch from {url}: {e}")
+            continue
         
-    except requests.exceptions.RequestException as e:
-        logging.error(f"API request failed: {e}")
-        return None
-    except Exception as e:
-        logging.error(f"Unexpected error during data fetch: {e}")
-        return None
-
-def store_crypto_data(data):
+        if result is NOT_MODIFIED:
+            not_modified += 1
+        else:
+            data.update(result)
+    
+    if not_modified == len(_ENDPOINTS):
+        logging.info("Prices not modified since last fetch")
+        return NOT_MODIFIED
+    
+    return data or None
+
+# Relative change below which a new price row is treated as a repeat of the last one
+_DEDUP_EPSILON = 1e-5
+
+def _is_unchanged(new, old):
+    """Check whether a value moved less than _DEDUP_EPSILON relative to the stored one"""
+    if new is None or old is None:
+        return new is old
+    if old == 0:
+        return new == 0
+    return abs(new - old) / abs(old) < _DEDUP_EPSILON
+
+def store_crypto_data(data, conn=None):
     """Store cryptocurrency data in database"""
     if not data:
         logging.warning("No data to store")
         return False
         
-    conn = sqlite3.connect("data/crypto.db")
-    cursor = conn.cursor()
+    conn = conn or _get_connection()
+    timestamp = int(time.time())
     
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    stored_count = 0
-    
-    try:
-        for coin_id, coin_data in data.items():
-            if 'usd' in coin_data:
-                symbol = CRYPTOCURRENCIES.get(coin_id, coin_id.upper())
-                price = coin_data['usd']
-                market_cap = coin_data.get('usd_market_cap')
-                volume_24h = coin_data.get('usd_24h_vol')
-                price_change_24h = coin_data.get('usd_24h_change')
-                
-                cursor.execute("""
-                    INSERT INTO prices (symbol, name, price_usd, timestamp, market_cap, volume_24h, price_change_24h)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (symbol, coin_id, price, timestamp, market_cap, volume_24h, price_change_24h))
-                
-                stored_count += 1
-                logging.info(f"Stored data for {symbol}: ${price:,.2f}")
+    with _DB_LOCK:
+        cursor = conn.cursor()
         
-        conn.commit()
-        logging.info(f"Successfully stored data for {stored_count} cryptocurrencies")
-        return True
+        # Manage the transaction explicitly so every row lands in a single commit
+        try:
+            rows = [
+                (CRYPTOCURRENCIES.get(coin_id, coin_id.upper()), coin_id, coin_data['usd'], timestamp,
+                 coin_data.get('usd_market_cap'), coin_data.get('usd_24h_vol'), coin_data.get('usd_24h_change'))
+                for coin_id, coin_data in data.items() if 'usd' in coin_data
+            ]
+            
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Skip coins whose price and market cap have not moved since their last stored row;
+            # one seek on idx_prices_symbol_id per fetched coin, so the write lock is held briefly
+            last = {}
+            for row in rows:
+                previous = cursor.execute(
+                    "SELECT price_usd, market_cap FROM prices WHERE symbol = ? ORDER BY id DESC LIMIT 1",
+                    (row[0],)
+                ).fetchone()
+                if previous is not None:
+                    last[row[0]] = previous
+            skipped = len(rows)
+            rows = [
+                row for row in rows
+                if row[0] not in last
+                or not (_is_unchanged(row[2], last[row[0]][0]) and _is_unchanged(row[4], last[row[0]][1]))
+            ]
+            skipped -= len(rows)
+            
+            cursor.executemany("""
+                INSERT INTO prices (symbol, name, price_usd, timestamp, market_cap, volume_24h, price_change_24h)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            cursor.execute("COMMIT")
+            
+        except Exception as e:
+            logging.error(f"Error storing data: {e}")
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            # Forget the ETags so the next tick downloads this snapshot again instead of a 304
+            _PENDING_ETAGS.clear()
+            return False
         
-    except Exception as e:
-        logging.error(f"Error storing data: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+        _LAST_ETAGS.update(_PENDING_ETAGS)
+        _PENDING_ETAGS.clear()
+    
+    # Log once, after the write lock is released
+    if not rows:
+        logging.info(f"No price changes to store, all {skipped} cryptocurrencies unchanged")
+        return True
+    
+    prices = {row[0]: row[2] for row in rows}
+    logging.info(f"Successfully stored data for {len(rows)} cryptocurrencies: {prices}")
+    if skipped:
+        logging.info(f"Skipped {skipped} unchanged cryptocurrencies")
+    return True
 
 def fetch_and_store():
     """Main function to fetch and store cryptocurrency data"""
     logging.info("Starting cryptocurrency data fetch")
     
-    # Ensure database schema exists
-    create_database_schema()
+    # Ensure database schema exists (normally done once at process start)
+    if not _SCHEMA_READY:
+        create_database_schema()
     
     # Fetch data from API
     data = fetch_crypto_data()
     
+    # Nothing new to store
+    if data is NOT_MODIFIED:
+        logging.info("Data collection skipped, prices unchanged")
+        return True
+    
     # Store data in database
     success = store_crypto_data(data)
     
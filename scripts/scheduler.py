@@ -1,9 +1,9 @@
-import schedule
-import time
 import logging
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from fetch_data import fetch_and_store
+from apscheduler.schedulers.blocking import BlockingScheduler
+from fetch_data import (NOT_MODIFIED, create_database_schema, fetch_crypto_data,
+                        optimize_database, shutdown_fetch_pool, store_crypto_data)
 from analytics import CryptoAnalytics
 
 # Configure logging for scheduler
@@ -21,37 +21,70 @@ logger = logging.getLogger(__name__)
 class CryptoDataScheduler:
     def __init__(self):
         self.analytics = CryptoAnalytics()
+        self.scheduler = BlockingScheduler()
         self.failed_attempts = 0
         self.max_failures = 5
         self.consecutive_failures = 0
+        self.last_run = None
+        
+        # One worker runs the fetch and store, the other the analytics for the previous tick
+        self._io = ThreadPoolExecutor(max_workers=2)
+        self._analytics_pending = False
         
     def fetch_data_with_retry(self):
         """Fetch data with retry logic and error handling"""
+        # Captured once per tick and reported by get_status
+        self.last_run = datetime.now()
+        
         try:
             logger.info("Starting scheduled data fetch")
-            success = fetch_and_store()
+            self._io.submit(self.fetch_and_store_prices).add_done_callback(self.handle_fetch_result)
             
-            if success:
-                self.consecutive_failures = 0
-                self.failed_attempts = 0
-                logger.info("Data fetch completed successfully")
-                
-                # Update analytics after successful data fetch
-                try:
-                    logger.info("Updating analytics")
-                    self.analytics.update_all_analytics()
-                    logger.info("Analytics update completed")
-                except Exception as e:
-                    logger.error(f"Analytics update failed: {e}")
-                    logger.error(traceback.format_exc())
-            else:
-                self.handle_failure()
+            # Update analytics for the data the previous tick stored while this request is in flight
+            if self._analytics_pending:
+                self._analytics_pending = False
+                self._io.submit(self.update_analytics)
                 
-        except Exception as e:
-            logger.error(f"Unexpected error in data fetch: {e}")
-            logger.error(traceback.format_exc())
+        except Exception:
+            logger.exception("Unexpected error in data fetch")
             self.handle_failure()
     
+    def fetch_and_store_prices(self):
+        """Fetch the latest prices and store them, returning whether the tick succeeded"""
+        data = fetch_crypto_data()
+        
+        # Nothing new to store
+        if data is NOT_MODIFIED:
+            logger.info("Prices unchanged since last fetch")
+            return True
+        
+        return store_crypto_data(data)
+    
+    def handle_fetch_result(self, future):
+        """Update failure counters once a fetch and store has completed"""
+        try:
+            success = future.result()
+        except Exception:
+            logger.exception("Unexpected error in data fetch")
+            success = False
+        
+        if success:
+            self.consecutive_failures = 0
+            self.failed_attempts = 0
+            self._analytics_pending = True
+            logger.info("Data fetch completed successfully")
+        else:
+            self.handle_failure()
+    
+    def update_analytics(self):
+        """Update analytics after a successful data fetch"""
+        try:
+            logger.info("Updating analytics")
+            self.analytics.update_incremental()
+            logger.info("Analytics update completed")
+        except Exception:
+            logger.exception("Analytics update failed")
+    
     def handle_failure(self):
         """Handle failed data fetch attempts"""
         self.consecutive_failures += 1
@@ -67,23 +100,38 @@ class CryptoDataScheduler:
     
     def get_status(self):
         """Get current scheduler status"""
+        fetch_job = self.scheduler.get_job('fetch_data')
         return {
             'total_failures': self.failed_attempts,
             'consecutive_failures': self.consecutive_failures,
-            'last_run': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'next_run': schedule.next_run()
+            'last_run': self.last_run,
+            'next_run': fetch_job.next_run_time if fetch_job else None
         }
     
+    def log_status(self):
+        """Log current scheduler status"""
+        logger.info(f"Scheduler status: {self.get_status()}")
+    
     def run_scheduler(self, interval_minutes=5):
         """Run the scheduler with specified interval"""
         logger.info(f"Starting crypto data scheduler with {interval_minutes} minute intervals")
         logger.info(f"Monitoring {len(self.analytics.get_all_symbols())} cryptocurrencies")
         
         # Schedule data fetching
-        schedule.every(interval_minutes).minutes.do(self.fetch_data_with_retry)
+        self.scheduler.add_job(self.fetch_data_with_retry, 'interval', minutes=interval_minutes, id='fetch_data')
+        
+        # Schedule analytics update every hour, recomputing only symbols with new rows
+        self.scheduler.add_job(self.analytics.update_incremental, 'cron', minute=0, id='update_analytics')
         
-        # Schedule analytics update every hour
-        schedule.every().hour.do(self.analytics.update_all_analytics)
+        # Keep SQLite planner statistics fresh
+        self.scheduler.add_job(optimize_database, 'interval', minutes=15, id='optimize_database')
+        
+        # Log status every hour
+        self.scheduler.add_job(self.log_status, 'cron', minute=0, id='log_status')
+        
+        # Full analytics pass once at startup; later updates are incremental
+        logger.info("Warming up analytics")
+        self.analytics.update_all_analytics()
         
         # Initial data fetch
         logger.info("Running initial data fetch")
@@ -92,23 +140,22 @@ class CryptoDataScheduler:
         logger.info("Scheduler started. Press Ctrl+C to stop.")
         
         try:
-            while True:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
-                
-                # Log status every hour
-                if datetime.now().minute == 0:
-                    status = self.get_status()
-                    logger.info(f"Scheduler status: {status}")
-                    
-        except KeyboardInterrupt:
+            # Sleeps until the next job is due instead of polling
+            self.scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
             logger.info("Scheduler stopped by user")
-        except Exception as e:
-            logger.error(f"Scheduler error: {e}")
-            logger.error(traceback.format_exc())
+        except Exception:
+            logger.exception("Scheduler error")
+        finally:
+            # Let an in-flight fetch finish its commit before exiting
+            self._io.shutdown(wait=True)
+            shutdown_fetch_pool()
 
 def main():
     """Main function to run the scheduler"""
+    # Create or migrate the schema once instead of on every fetch
+    create_database_schema()
+    
     scheduler = CryptoDataScheduler()
     
     # You can adjust the interval here (1-5 minutes recommended)
@@ -0,0 +1,139 @@
+import re
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _create_prices_table(cursor, name):
+    """Create a prices table with the current schema under the given name"""
+    # Timestamps are stored as INTEGER Unix seconds: 8 bytes per row and no parsing on read
+    cursor.execute(f"""
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            symbol TEXT NOT NULL,
+            name TEXT NOT NULL,
+            price_usd REAL NOT NULL,
+            timestamp INTEGER NOT NULL,
+            market_cap REAL,
+            volume_24h REAL,
+            price_change_24h REAL
+        )
+    """)
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Create the tables and indexes, migrating older layouts of the prices table in place"""
+    # IMMEDIATE takes the write lock before the schema is inspected, so a dashboard and the
+    # scheduler starting together cannot both decide to migrate
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    
+    try:
+        rebuilt = False
+        
+        # Check if old schema exists and migrate if needed (one lookup of the stored CREATE statement)
+        table_sql = cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='prices'"
+        ).fetchone()
+        
+        if table_sql:
+            # Check if we have the old schema (with 'rate' column)
+            needs_migration = (re.search(r'\brate\b', table_sql[0]) is not None
+                               and re.search(r'\bsymbol\b', table_sql[0]) is None)
+            
+            # Check if timestamps are still stored as TEXT instead of epoch seconds
+            needs_epoch_migration = re.search(r'\btimestamp\s+TEXT\b', table_sql[0], re.IGNORECASE) is not None
+            
+            if needs_migration:
+                logger.info("Migrating from old schema to new schema")
+                # Create new table with enhanced schema alongside the old one
+                _create_prices_table(cursor, "prices_new")
+                
+                # Stream old data across in chunks (assuming it's Bitcoin data) so the
+                # legacy table is never held in memory at once
+                src = conn.cursor()
+                src.execute("SELECT rate, timestamp FROM prices")
+                migrated = 0
+                for chunk in iter(lambda: src.fetchmany(1000), []):
+                    cursor.executemany("""
+                        INSERT INTO prices_new (symbol, name, price_usd, timestamp, market_cap, volume_24h, price_change_24h)
+                        VALUES (?, ?, ?, CAST(strftime('%s', ?, 'utc') AS INTEGER), ?, ?, ?)
+                    """, [('BTC', 'bitcoin', row[0], row[1], None, None, None) for row in chunk])
+                    migrated += len(chunk)
+                src.close()
+                
+                # Swap the new table in for the old one
+                cursor.execute("DROP TABLE prices")
+                cursor.execute("ALTER TABLE prices_new RENAME TO prices")
+                
+                rebuilt = True
+                logger.info(f"Migrated {migrated} records from old schema")
+            
+            elif needs_epoch_migration:
+                logger.info("Converting price timestamps to epoch seconds")
+                # A TEXT column would coerce integers back to text, so the table is rebuilt;
+                # stored timestamps are local time, hence the 'utc' modifier
+                _create_prices_table(cursor, "prices_new")
+                cursor.execute("""
+                    INSERT INTO prices_new (id, symbol, name, price_usd, timestamp, market_cap, volume_24h, price_change_24h)
+                    SELECT id, symbol, name, price_usd, CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+                           market_cap, volume_24h, price_change_24h
+                    FROM prices
+                """)
+                converted = cursor.rowcount
+                
+                # Swap the new table in for the old one
+                cursor.execute("DROP TABLE prices")
+                cursor.execute("ALTER TABLE prices_new RENAME TO prices")
+                
+                rebuilt = True
+                logger.info(f"Converted {converted} records to epoch timestamps")
+        
+        else:
+            # Create new table with enhanced schema
+            _create_prices_table(cursor, "prices")
+        
+        # Analytics table for computed metrics
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS analytics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                metric_name TEXT NOT NULL,
+                metric_value REAL NOT NULL,
+                time_period TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                UNIQUE(symbol, metric_name, time_period, timestamp)
+            )
+        """)
+        
+        # Last price row id each incremental job has processed
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                metric TEXT PRIMARY KEY,
+                last_id INTEGER
+            )
+        """)
+        
+        # Create indexes for better performance (only if columns exist); done after any
+        # migration so the index is built once over the final data
+        try:
+            # Covering index: symbol/time range scans read every needed column from the index
+            # itself, without a rowid lookup, so the narrower (symbol, timestamp) one is redundant
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_prices_cover
+                ON prices(symbol, timestamp, price_usd, market_cap, volume_24h, price_change_24h)
+            """)
+            cursor.execute("DROP INDEX IF EXISTS idx_prices_symbol_time")
+            # Latest row per symbol, for the market snapshot and the incremental analytics watermark
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_prices_symbol_id ON prices(symbol, id DESC)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_analytics_symbol_metric ON analytics(symbol, metric_name)")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Could not create indexes: {e}")
+        
+        # Give the planner statistics for the rebuilt table and its new index
+        if rebuilt:
+            cursor.execute("ANALYZE prices")
+        
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
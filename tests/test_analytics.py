@@ -0,0 +1,79 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+from analytics import CryptoAnalytics
+
+
+class AnalyticsPathsAgreeTest(unittest.TestCase):
+    """The vectorized and per-symbol analytics paths must report the same metrics"""
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE prices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                name TEXT NOT NULL,
+                price_usd REAL NOT NULL,
+                timestamp INTEGER NOT NULL,
+                market_cap REAL,
+                volume_24h REAL,
+                price_change_24h REAL
+            )
+        """)
+
+        # Hourly random walks of different lengths, including ones just past the RSI period;
+        # offset by half an hour so no row sits on a window cutoff while the clock ticks
+        rng = np.random.default_rng(42)
+        now = int(time.time()) + 1800
+        rows = []
+        for symbol, count in [('AAA', 20), ('BBB', 30), ('CCC', 500)]:
+            prices = 100 * np.cumprod(1 + rng.normal(0, 0.01, count))
+            for i, price in enumerate(prices):
+                rows.append((symbol, symbol.lower(), float(price), now - (count - i) * 3600,
+                             float(price) * 1e6, float(price) * 1e4, None))
+        conn.executemany("""
+            INSERT INTO prices (symbol, name, price_usd, timestamp, market_cap, volume_24h, price_change_24h)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        conn.close()
+
+        self.analytics = CryptoAnalytics(self.db_path)
+
+    def tearDown(self):
+        self.analytics.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_rsi_matches(self):
+        all_analytics = self.analytics.generate_all_analytics()
+        for symbol in ('AAA', 'BBB', 'CCC'):
+            single = self.analytics.generate_comprehensive_analytics(symbol)
+            self.assertIsNotNone(single['rsi_14'])
+            self.assertEqual(all_analytics[symbol]['rsi_14'], single['rsi_14'])
+
+    def test_all_metrics_match(self):
+        all_analytics = self.analytics.generate_all_analytics(['AAA', 'CCC'])
+        self.assertEqual(set(all_analytics), {'AAA', 'CCC'})
+        for symbol, vectorized in all_analytics.items():
+            single = self.analytics.generate_comprehensive_analytics(symbol)
+            for key in single:
+                if key != 'timestamp':
+                    self.assertEqual(vectorized[key], single[key], f"{symbol} {key}")
+
+
+if __name__ == '__main__':
+    unittest.main()